@@ -2,10 +2,14 @@
 
 # Importing all the required libraries
 
+import io
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from datetime import timedelta
-import plotly.express as px
+import plotly.graph_objects as go
 
 from utils.scheduler import schedule_loads
 from utils.prediction_pipeline import predict_next_day_production
@@ -18,6 +22,7 @@ st.title("🔋 Strathmore University Energy Management Dashboard")
 LATITUDE = -1.2921
 LONGITUDE = 36.8219
 NBO_TZ = "Africa/Nairobi"
+LTTB_THRESHOLD = 2000  # points; beyond this the line charts get downsampled before rendering
 
 # Computation of "tomorrow" in Africa/Nairobi to show on the dashboard
 now_nbo = pd.Timestamp.now(tz=NBO_TZ)
@@ -27,9 +32,17 @@ st.caption(f"Prediction date: **{day_start.strftime('%A, %d %B %Y')}** (Africa/N
 
 # Cache the Predictions
 
-@st.cache_data(ttl=60 * 15)  # cache for 15 minutes
+def _hash_frame(df: pd.DataFrame) -> bytes:
+    """Content hash used as the cache key for DataFrame arguments."""
+    return pd.util.hash_pandas_object(df, index=True).values.tobytes()
+
+@st.cache_resource(ttl=60 * 15)  # cache for 15 minutes
 def _predict_cached(lat: float, lon: float) -> pd.DataFrame:
-    """Call the pipeline and cache the DataFrame."""
+    """
+    Call the pipeline and cache the DataFrame.
+    Held as a shared resource so cache hits return the same object instead of a
+    deserialized copy: treat it as READ-ONLY (derive new frames, never assign into it).
+    """
     return predict_next_day_production(lat=lat, lon=lon)
 
 # Forecast + Solar Predictions
@@ -37,21 +50,23 @@ def _predict_cached(lat: float, lon: float) -> pd.DataFrame:
 irradiance_data = _predict_cached(LATITUDE, LONGITUDE)
 
 # Quick sanity metrics (computed in Nairobi time)
-dfp = irradiance_data.sort_values("timestamp").copy()
-gti = pd.to_numeric(dfp["Global Tilted Irradiation"], errors="coerce").fillna(0)
-pv  = pd.to_numeric(dfp["predicted_solar_production"], errors="coerce").fillna(0)
+dfp = irradiance_data.sort_values("timestamp")   # sort_values already returns a new frame
 
-def _to_nairobi(ts: pd.Timestamp) -> pd.Timestamp:
-    ts = pd.to_datetime(ts)
-    if ts.tz is None:
-        return ts.tz_localize(NBO_TZ)
-    return ts.tz_convert(NBO_TZ)
+def _as_float_array(s: pd.Series) -> np.ndarray:
+    """Float32 view of a column with NaNs as 0; only coerces if the dtype isn't numeric already."""
+    if not pd.api.types.is_numeric_dtype(s):
+        s = pd.to_numeric(s, errors="coerce")
+    return s.to_numpy(dtype=np.float32, na_value=0.0)
 
-peak_gti_ts = _to_nairobi(dfp.loc[gti.idxmax(), "timestamp"])
-peak_pv_ts  = _to_nairobi(dfp.loc[pv.idxmax(),  "timestamp"])
+gti_arr = _as_float_array(dfp["Global Tilted Irradiation"])
+pv_arr  = _as_float_array(dfp["predicted_solar_production"])
 
-total_pv_kwh = float(pv.sum()) / 1000.0                 # Wh/slot to kWh
-daily_irr_kwh_m2 = float((gti * 0.5).sum() / 1000.0)    # W/m² * 0.5h to Wh/m² then to kWh/m²
+# Both peaks picked by position, then a single tz_convert on the 2-element slice
+i_gti, i_pv = int(np.argmax(gti_arr)), int(np.argmax(pv_arr))
+peak_gti_ts, peak_pv_ts = dfp["timestamp"].iloc[[i_gti, i_pv]].dt.tz_convert(NBO_TZ)
+
+total_pv_kwh = float(pv_arr.sum()) / 1000.0                 # Wh/slot to kWh
+daily_irr_kwh_m2 = float(gti_arr.sum()) * 0.5 / 1000.0      # W/m² * 0.5h to Wh/m² then to kWh/m²
 
 m1, m2, m3, m4 = st.columns(4)
 m1.metric("Peak GTI time", peak_gti_ts.strftime("%I:%M %p"))
@@ -59,153 +74,226 @@ m2.metric("Peak PV time",  peak_pv_ts.strftime("%I:%M %p"))
 m3.metric("Total PV (kWh)", f"{total_pv_kwh:,.0f}")
 m4.metric("Daily Irr (kWh/m²)", f"{daily_irr_kwh_m2:,.2f}")
 
-# Building a plotting frame in *local* time to align charts with metrics
-plot_df = irradiance_data.copy()
-# Ensuring tz-aware in Nairobi, then dropping tz so Vega-Lite won't convert to UTC
-plot_df["ts_local"] = (
-    pd.to_datetime(plot_df["timestamp"])
-      .dt.tz_convert(NBO_TZ)     # Nairobi tz-aware
-      .dt.tz_localize(None)      # making naive to prevent UTC auto-shift in Streamlit chart
-)
-plot_df = plot_df.set_index("ts_local")
-
-# The Charts row
-col1, col2 = st.columns(2)
-
-with col1:
-    st.subheader("🌤️ Forecasted Irradiance (Next Day)")
-    st.line_chart(plot_df["Global Tilted Irradiation"], use_container_width=True)
-    st.caption("Series: Global Tilted Irradiation (GTI), units: W/m² — times shown in Africa/Nairobi")
-
-with col2:
-    st.subheader("☀️ Predicted Solar Production (Next Day)")
-    st.line_chart(plot_df["predicted_solar_production"], use_container_width=True)
-    st.caption("Series: Predicted PV output, units: Wh per 30-min slot — times shown in Africa/Nairobi")
+# Building a plotting frame in *local* time to align charts with metrics.
+# `ts_local` comes from the pipeline already naive, so Plotly won't shift the times to UTC
+plot_df = irradiance_data[["ts_local", "Global Tilted Irradiation", "predicted_solar_production"]].set_index("ts_local")
+
+def _line_figure(series: pd.Series, y_title: str) -> go.Figure:
+    """
+    WebGL line chart for a time-indexed series. Long series are LTTB-downsampled
+    server-side (plotly-resampler) so the browser never gets thousands of points.
+    """
+    trace = go.Scattergl(mode="lines", name=series.name)
+    fig = None
+    if len(series) > LTTB_THRESHOLD:
+        try:
+            # Optional, and imported only here: it pulls in dash/flask, which short series never need
+            from plotly_resampler import FigureResampler
+        except ImportError:
+            pass   # not installed, so every point gets shipped
+        else:
+            fig = FigureResampler(go.Figure(), default_n_shown_samples=LTTB_THRESHOLD)
+            fig.add_trace(trace, hf_x=series.index, hf_y=series.to_numpy())
+    if fig is None:
+        trace.update(x=series.index, y=series.to_numpy())
+        fig = go.Figure(trace)
+    fig.update_layout(
+        height=360,
+        margin=dict(l=10, r=10, t=10, b=10),
+        xaxis_title="Time of Day (Africa/Nairobi)",
+        yaxis_title=y_title,
+    )
+    fig.update_xaxes(tickformat="%H:%M")
+    return fig
+
+# The Charts row. A fragment, so interactions inside it only redraw these two charts
+@st.fragment
+def _forecast_charts(plot_df: pd.DataFrame):
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("🌤️ Forecasted Irradiance (Next Day)")
+        st.plotly_chart(_line_figure(plot_df["Global Tilted Irradiation"], "W/m²"), use_container_width=True)
+        st.caption("Series: Global Tilted Irradiation (GTI), units: W/m² — times shown in Africa/Nairobi")
+
+    with col2:
+        st.subheader("☀️ Predicted Solar Production (Next Day)")
+        st.plotly_chart(_line_figure(plot_df["predicted_solar_production"], "Wh per slot"), use_container_width=True)
+        st.caption("Series: Predicted PV output, units: Wh per 30-min slot — times shown in Africa/Nairobi")
+
+_forecast_charts(plot_df)
 
 # Building an Optimal Load Schedule 
 
-load_data = pd.read_csv("data/load_data.csv", parse_dates=["timestamp"])
-scheduled_df = schedule_loads(load_data, irradiance_data)
+@st.cache_data
+def _load_csv(path: str) -> pd.DataFrame:
+    """
+    Read a timestamped CSV once (shared across sessions) instead of on every rerun.
+    The pyarrow engine parses columns in parallel; offsets like +03:00 come back as UTC,
+    which is fine since schedule_loads converts to Nairobi anyway.
+    """
+    return pd.read_csv(path, engine="pyarrow", parse_dates=["timestamp"])
+
+@st.cache_data(ttl=60 * 15, hash_funcs={pd.DataFrame: _hash_frame})  # same window as the forecast
+def _schedule(load_df: pd.DataFrame, irr_df: pd.DataFrame) -> pd.DataFrame:
+    """Run the scheduler only when the load or forecast content actually changes."""
+    return schedule_loads(load_df, irr_df)
+
+load_data = _load_csv("data/load_data.csv")
+scheduled_df = _schedule(load_data, irradiance_data)
 
-def _build_timeline_from_schedule(df: pd.DataFrame, device_cols):
+@st.cache_data
+def _device_cols(cols: tuple) -> list:
+    """Controllable device columns (everything *_kW except base/total), cached per schema."""
+    return [c for c in cols if c.endswith("_kW") and c not in ("base_load_kW", "total_load_kW")]
+
+@st.cache_data(hash_funcs={pd.DataFrame: _hash_frame})
+def _build_timeline_from_schedule(df: pd.DataFrame, device_cols, day_start: pd.Timestamp, day_end: pd.Timestamp):
     """
     Convert a 30-min schedule dataframe into contiguous (Start, End) intervals per device.
+    Expects `timestamp` to already be tz-aware in Africa/Nairobi. Only runs starting in
+    [day_start, day_end) are kept; the bounds are arguments so they're part of the cache key.
     Returns a frame with tz-aware Start/End in Africa/Nairobi plus naive local copies
-    for plotting (prevents Plotly from auto-converting to UTC).
+    for plotting (Streamlit shifts naive timestamps so Vega-Lite's local time scale shows them as-is).
     """
-    # Ensuring that tz-aware in Nairobi
-    df = df.copy()
-    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True).dt.tz_convert(NBO_TZ)
     df = df.sort_values("timestamp").set_index("timestamp")
 
-    rows = []
+    # On/off matrix (slots x devices)
+    on = df[device_cols].fillna(0).to_numpy() > 0
+    ts_index = df.index
+
+    # Restriction to tomorrow for safety: only keep runs whose first slot falls in [lo, hi)
+    lo, hi = ts_index.searchsorted([day_start, day_end])
+
+    # Display names, cleaned once per column ("Water_Heater_kW" -> "Water Heater")
+    pretty = {c: c.replace("_kW", "").replace("_", " ") for c in device_cols}
+
+    devices, starts, ends = [], [], []
+    for j, col in enumerate(device_cols):
+        # Working only on the "on" slots, so sparsely scheduled devices cost next to nothing.
+        # A gap between consecutive on-slots marks where one run ends and the next begins.
+        on_idx = np.flatnonzero(on[:, j])
+        if on_idx.size == 0:
+            continue
+        breaks = np.flatnonzero(np.diff(on_idx) != 1)
+        start_idx = on_idx[np.r_[0, breaks + 1]]
+        last_idx = on_idx[np.r_[breaks, on_idx.size - 1]]   # last "on" slot of each run
 
-    for col in device_cols:
-        s = df[col].fillna(0)
-        if (s > 0).sum() == 0:
+        keep = slice(*np.searchsorted(start_idx, [lo, hi]))
+        start_idx, last_idx = start_idx[keep], last_idx[keep]
+        if start_idx.size == 0:
             continue
 
-        in_run = False
-        start_ts = None
-        prev_ts = None
-
-        for ts, val in s.items():
-            on = val > 0
-            if on and not in_run:
-                start_ts = ts
-                in_run = True
-            elif (not on) and in_run:
-                end_ts = prev_ts + pd.Timedelta(minutes=30)
-                rows.append({
-                    "Device": col.replace("_kW", "").replace("_", " "),
-                    "Start": start_ts,     # tz-aware
-                    "End": end_ts,         # tz-aware (right-exclusive)
-                })
-                in_run = False
-            prev_ts = ts
-
-        # If we ended while still running, close the interval
-        if in_run and prev_ts is not None:
-            end_ts = prev_ts + pd.Timedelta(minutes=30)
-            rows.append({
-                "Device": col.replace("_kW", "").replace("_", " "),
-                "Start": start_ts,
-                "End": end_ts,
-            })
-
-    timeline = pd.DataFrame(rows)
-    if timeline.empty:
-        return timeline
-
-    # Restriction to tomorrow for safety
-    mask = (timeline["Start"] >= day_start) & (timeline["Start"] < day_end)
-    timeline = timeline.loc[mask].copy()
-
-
-    timeline["StartLocal"] = timeline["Start"].dt.tz_convert(NBO_TZ).dt.tz_localize(None)
-    timeline["EndLocal"]   = timeline["End"].dt.tz_convert(NBO_TZ).dt.tz_localize(None)
+        devices.append(np.full(start_idx.size, pretty[col], dtype=object))
+        starts.append(ts_index[start_idx])
+        ends.append(ts_index[last_idx] + pd.Timedelta(minutes=30))
+
+    if not devices:
+        return pd.DataFrame()
+
+    timeline = pd.DataFrame({
+        "Device": np.concatenate(devices),
+        "Start": starts[0].append(starts[1:]),   # tz-aware
+        "End": ends[0].append(ends[1:]),         # tz-aware (right-exclusive)
+    })
+
+    # Start/End are already in Nairobi, so dropping the tz is enough
+    timeline["StartLocal"] = timeline["Start"].dt.tz_localize(None)
+    timeline["EndLocal"]   = timeline["End"].dt.tz_localize(None)
 
 
     timeline["Duration (min)"] = (timeline["End"] - timeline["Start"]).dt.total_seconds() / 60.0
 
     return timeline
 
-# Keep only tomorrow and devices
-sched_plot = scheduled_df.copy()
-sched_plot["timestamp"] = pd.to_datetime(sched_plot["timestamp"], utc=True).dt.tz_convert(NBO_TZ)
-sched_plot = sched_plot[(sched_plot["timestamp"] >= day_start) & (sched_plot["timestamp"] < day_end)].copy()
-
-device_columns = [
-    c for c in sched_plot.columns
-    if c.endswith("_kW") and c not in ("base_load_kW", "total_load_kW")
-]
-
-timeline_df = _build_timeline_from_schedule(sched_plot, device_columns)
-
-st.subheader(f"🗓️ Optimal Load Schedule — {day_start.strftime('%d %b %Y')} (30-min slots)")
-if timeline_df.empty:
-    st.info("No controllable loads were scheduled for tomorrow.")
-else:
-    # Using the local naive columns so Plotly doesn't auto-convert timezones
-    fig_timeline = px.timeline(
-        timeline_df,
-        x_start="StartLocal",
-        x_end="EndLocal",
-        y="Device",
-        color="Device",
-        hover_data={
-            "StartLocal": True,
-            "EndLocal": True,
-            "Duration (min)": True,
-            "Start": False,   # hides tz-aware versions from hover
-            "End": False,
-        },
-        title=f"Device Run Windows (Africa/Nairobi) — {day_start.strftime('%d %b %Y')}",
-        template="plotly_dark"
-    )
-    # Showing devices from top to bottom
-    fig_timeline.update_yaxes(autorange="reversed")
-    # Fixing x-axis to tomorrow (local, naive)
-    x0 = day_start.tz_convert(NBO_TZ).tz_localize(None)
-    x1 = day_end.tz_convert(NBO_TZ).tz_localize(None)
-    fig_timeline.update_xaxes(
-        range=[x0, x1],
-        tickformat="%H:%M",
-        tick0=x0,
-        dtick=2 * 60 * 60 * 1000  # every 2 hours
-    )
-    fig_timeline.update_traces(opacity=0.95, selector=dict(type="bar"))
-    fig_timeline.update_layout(
-        height=460,
-        legend_title_text="Device",
-        xaxis_title="Time of Day (Africa/Nairobi)",
-        yaxis_title=""
-    )
-    st.plotly_chart(fig_timeline, use_container_width=True)
+# Keep only tomorrow and devices (schedule_loads already returns Nairobi-aware timestamps)
+# Sorted, so tomorrow is a contiguous slice found by binary search instead of two boolean masks
+sched_plot = scheduled_df.sort_values("timestamp", ignore_index=True)
+lo, hi = sched_plot["timestamp"].searchsorted([day_start, day_end])
+sched_plot = sched_plot.iloc[lo:hi]
+
+device_columns = _device_cols(tuple(sched_plot.columns))
 
-# Export scheduled loads
+timeline_df = _build_timeline_from_schedule(sched_plot, device_columns, day_start, day_end)
 
-csv = scheduled_df.to_csv(index=False).encode("utf-8")
-st.download_button("⬇️ Download Load Schedule CSV", csv, file_name="scheduled_loads.csv", mime="text/csv")
+# CSV bytes for the schedule download (cached, used by _schedule_ui below)
+
+@st.cache_data(hash_funcs={pd.DataFrame: _hash_frame})
+def _schedule_csv(df: pd.DataFrame) -> bytes:
+    """
+    UTF-8 CSV bytes written straight from Arrow buffers (no intermediate Python str).
+    Timestamps are pre-formatted to the same ISO text as to_csv ("2026-10-15 06:00:00+03:00")
+    and nothing is quoted, so the file reads like the old export. Whole-number floats
+    do come out as "4" rather than "4.0" (Arrow's float formatting).
+    """
+    out = df.assign(timestamp=df["timestamp"].astype(str))
+    buf = io.BytesIO()
+    pacsv.write_csv(
+        pa.Table.from_pandas(out, preserve_index=False),
+        buf,
+        # "none" raises instead of quoting if a value ever needs it; the schedule is all numbers/timestamps
+        pacsv.WriteOptions(quoting_header="none", quoting_style="none"),
+    )
+    return buf.getvalue()
+
+# Schedule chart + CSV download as one fragment: clicking download (or any future widget
+# in here) reruns just this block instead of the whole forecast/scheduling script
+@st.fragment
+def _schedule_ui(timeline_df: pd.DataFrame, scheduled_df: pd.DataFrame):
+    st.subheader(f"🗓️ Optimal Load Schedule — {day_start.strftime('%d %b %Y')} (30-min slots)")
+    if timeline_df.empty:
+        st.info("No controllable loads were scheduled for tomorrow.")
+    else:
+        # Plain Vega-Lite spec instead of px.timeline, no Plotly figure building on every rerun.
+        # The naive local columns are what keep the times in Nairobi wall-clock: Streamlit's frontend
+        # adds the browser's UTC offset to naive timestamps, so Vega-Lite's default *local* time scale
+        # shows them unchanged in any viewer timezone. Don't use a "utc" scale/timeUnit here, it would
+        # undo that shift and move every bar by the viewer's offset.
+        x0 = day_start.tz_localize(None)
+        x1 = day_end.tz_localize(None)
+        device_order = timeline_df["Device"].unique().tolist()   # device-column order, top to bottom
+
+        def _vl_datetime(ts: pd.Timestamp) -> dict:
+            # Local DateTime (no "utc"), on the same footing as the shifted data
+            return {"year": ts.year, "month": ts.month, "date": ts.day, "hours": ts.hour}
+
+        # Explicit ticks every 2 hours across the day
+        ticks = [_vl_datetime(x0 + pd.Timedelta(hours=h)) for h in range(0, 25, 2)]
+
+        timeline_spec = {
+            "title": f"Device Run Windows (Africa/Nairobi) — {day_start.strftime('%d %b %Y')}",
+            "height": 460,
+            "mark": {"type": "bar", "opacity": 0.95},
+            "encoding": {
+                "x": {
+                    "field": "StartLocal",
+                    "type": "temporal",
+                    "title": "Time of Day (Africa/Nairobi)",
+                    "scale": {"domain": [_vl_datetime(x0), _vl_datetime(x1)]},
+                    "axis": {"format": "%H:%M", "values": ticks},
+                },
+                "x2": {"field": "EndLocal"},
+                "y": {"field": "Device", "type": "nominal", "sort": device_order, "title": None},
+                "color": {"field": "Device", "type": "nominal", "sort": device_order, "legend": {"title": "Device"}},
+                "tooltip": [
+                    {"field": "Device", "type": "nominal"},
+                    {"field": "StartLocal", "type": "temporal", "timeUnit": "hoursminutes", "title": "Start"},
+                    {"field": "EndLocal", "type": "temporal", "timeUnit": "hoursminutes", "title": "End"},
+                    {"field": "Duration (min)", "type": "quantitative"},
+                ],
+            },
+        }
+        # Only the naive local columns are shipped; the tz-aware Start/End stay server-side
+        st.vega_lite_chart(
+            timeline_df[["Device", "StartLocal", "EndLocal", "Duration (min)"]],
+            timeline_spec,
+            use_container_width=True,
+        )
+
+    # Export scheduled loads
+    csv = _schedule_csv(scheduled_df)
+    st.download_button("⬇️ Download Load Schedule CSV", csv, file_name="scheduled_loads.csv", mime="text/csv")
+
+_schedule_ui(timeline_df, scheduled_df)
 
 
@@ -0,0 +1,27 @@
+# utils/export_onnx.py
+
+# One-time conversion of the trained XGBoost model to ONNX.
+# When models/xgb.onnx exists and onnxruntime is installed, the prediction pipeline
+# serves the model through ONNX Runtime instead of the XGBoost booster.
+# Needs the optional packages: onnx, onnxmltools (export) and onnxruntime (serving).
+
+import joblib
+import onnx
+import onnxmltools
+from onnxmltools.convert.common.data_types import FloatTensorType
+
+N_FEATURES = 4  # GTI, air_temp, hour, dayofyear (see prediction_pipeline.build_features)
+
+def export_onnx(model_path="models/xgb_model.pkl", save_path="models/xgb.onnx"):
+    model = joblib.load(model_path)
+    onnx_model = onnxmltools.convert_xgboost(
+        model,
+        initial_types=[("X", FloatTensorType([None, N_FEATURES]))],
+    )
+    onnx.save(onnx_model, save_path)
+    print(f"ONNX model saved to: {save_path}")
+    return save_path
+
+# Testing the block
+if __name__ == "__main__":
+    export_onnx()
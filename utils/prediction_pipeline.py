@@ -1,11 +1,22 @@
 # utils/prediction_pipeline.py
 
+import numpy as np
 import pandas as pd
 import requests
 import joblib
+import logging
+import os
+import streamlit as st
 from datetime import datetime, timedelta
 
+logger = logging.getLogger(__name__)
+
 NBO_TZ = "Africa/Nairobi"
+MODEL_PATH = "models/xgb_model.pkl"
+ONNX_MODEL_PATH = "models/xgb.onnx"   # optional export of MODEL_PATH, see utils/export_onnx.py
+
+# One pooled session per process so ttl refreshes reuse the keep-alive TCP/TLS connection
+_SESSION = requests.Session()
 
 def fetch_openmeteo_forecast(lat, lon):
     """
@@ -13,6 +24,11 @@ def fetch_openmeteo_forecast(lat, lon):
     We explicitly LOCALIZE to Africa/Nairobi (do NOT convert from UTC).
     """
     tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    return _fetch_openmeteo_cached(lat, lon, tomorrow)
+
+
+@st.cache_data(ttl=60 * 15)  # cache for 15 minutes, keyed on (lat, lon, date)
+def _fetch_openmeteo_cached(lat, lon, tomorrow):
     url = (
         f"https://api.open-meteo.com/v1/forecast?"
         f"latitude={lat}&longitude={lon}"
@@ -20,7 +36,7 @@ def fetch_openmeteo_forecast(lat, lon):
         f"&start_date={tomorrow}&end_date={tomorrow}"
         f"&timezone=Africa%2FNairobi"
     )
-    r = requests.get(url, timeout=30)
+    r = _SESSION.get(url, timeout=30)
     r.raise_for_status()
     data = r.json()
 
@@ -37,45 +53,107 @@ def fetch_openmeteo_forecast(lat, lon):
 
 def clean_forecast_data(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Small sanitization + features; keep timestamps tz-aware in Nairobi.
+    Small sanitization; keep timestamps tz-aware in Nairobi. Model features are built by build_features().
+    Columns are filled on the frame passed in (fetch_openmeteo_forecast hands out a fresh one each call).
     """
-    df = df.sort_values("timestamp").copy()
-
-    # Smoothing any tiny spikes in GTI. Uses a 3-point rolling mean. Nice for how the visuals look. Not too important.
-    df["Global Tilted Irradiation"] = (
-        df["Global Tilted Irradiation"]
-        .rolling(window=3, center=True, min_periods=1)
-        .mean()
-    )
+    # Open-Meteo already returns hours in ascending order, so only sort (and copy) if it didn't
+    if not df["timestamp"].is_monotonic_increasing:
+        df = df.sort_values("timestamp", ignore_index=True)
+
+    # Smoothing any tiny spikes in GTI. Uses a 3-point centred mean. Nice for how the visuals look. Not too important.
+    # Same result as .rolling(3, center=True, min_periods=1).mean(): sum the valid neighbours and
+    # divide by how many there were, so edges and NaN gaps average over fewer points.
+    gti = df["Global Tilted Irradiation"].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(gti)
+    kernel = np.ones(3)
+    sums = np.convolve(np.where(valid, gti, 0.0), kernel)[1:-1]
+    counts = np.convolve(valid.astype(np.float64), kernel)[1:-1]
+    with np.errstate(invalid="ignore"):
+        df["Global Tilted Irradiation"] = sums / counts   # 0/0 -> NaN, like min_periods=1
+
+    # Filling tiny gaps in temperature. Linear interpolating in both directions so edge NaNs are filled in the same pass.
+    df["air_temp"] = df["air_temp"].interpolate(method="linear", limit_direction="both")
+    return df
 
-    # Filling tiny gaps in temperature. Linear interpolating, then backfilling or frontfilling any edge NaNs.
-    df["air_temp"] = df["air_temp"].interpolate().bfill().ffill()
 
-    # Adding time-based features
-    df["hour"] = df["timestamp"].dt.hour
-    df["dayofyear"] = df["timestamp"].dt.dayofyear
-    return df
+def build_features(df: pd.DataFrame) -> np.ndarray:
+    """
+    Model inputs as one (n, 4) array, filled column by column from the frame's arrays.
+    Column order must match the scaler's fit order: GTI, air_temp, hour, dayofyear.
+    Kept float64 here on purpose, scaling in float32 nudges values across tree split thresholds.
+    """
+    ts = df["timestamp"].dt
+    X = np.empty((len(df), 4), dtype=np.float64)
+    X[:, 0] = df["Global Tilted Irradiation"].to_numpy()
+    X[:, 1] = df["air_temp"].to_numpy()
+    X[:, 2] = ts.hour.to_numpy()
+    X[:, 3] = ts.dayofyear.to_numpy()
+    return X
 
 
+@st.cache_resource  # loaded once per process, shared across reruns and sessions
 def load_model_and_scaler():
-    model = joblib.load("models/xgb_model.pkl")
+    model = joblib.load(MODEL_PATH)
     scaler = joblib.load("models/xgb_scaler.pkl")
     return model, scaler
 
 
+def load_onnx_session():
+    """
+    ONNX Runtime session for the exported model, or None to fall back to the XGBoost booster:
+    not exported, older than MODEL_PATH (stale after a retrain), or onnxruntime not installed.
+    Re-checked on every call so a fresh export is picked up without restarting the app.
+    """
+    if not os.path.exists(ONNX_MODEL_PATH):
+        return None
+    onnx_mtime = os.path.getmtime(ONNX_MODEL_PATH)
+    if onnx_mtime < os.path.getmtime(MODEL_PATH):
+        logger.warning("%s is older than %s, ignoring it. Re-run utils/export_onnx.py.", ONNX_MODEL_PATH, MODEL_PATH)
+        return None
+    try:
+        import onnxruntime  # noqa: F401  (optional, only imported once an export exists)
+    except ImportError:
+        logger.warning("%s found but onnxruntime isn't installed, using the XGBoost booster.", ONNX_MODEL_PATH)
+        return None
+    return _onnx_session(ONNX_MODEL_PATH, onnx_mtime)
+
+
+@st.cache_resource
+def _onnx_session(path, mtime):
+    """One session per exported file; `mtime` is only there so a re-export gets a new session."""
+    import onnxruntime as ort
+    return ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+
 def predict_next_day_production(lat, lon):
     """
-    Return DataFrame with Nairobi-aware timestamps, the raw irradiance,
-    and the predicted solar production (Wh per 30-min slot).
+    Return DataFrame with Nairobi-aware timestamps (plus a naive local `ts_local`),
+    the raw irradiance, and the predicted solar production (Wh per 30-min slot).
     """
     forecast = fetch_openmeteo_forecast(lat, lon)
     forecast = clean_forecast_data(forecast)
 
     model, scaler = load_model_and_scaler()
 
-    feats = forecast[["Global Tilted Irradiation", "air_temp", "hour", "dayofyear"]]
-    feats_scaled = scaler.transform(feats)
-
-    forecast["predicted_solar_production"] = model.predict(feats_scaled)
+    X = build_features(forecast)
+    # Applying the fitted MinMaxScaler by hand (same ops as scaler.transform). transform() itself
+    # warns about the missing feature names because the scaler was fitted on a named DataFrame
+    X *= scaler.scale_
+    X += scaler.min_
+    if scaler.clip:
+        np.clip(X, *scaler.feature_range, out=X)
+    feats_scaled = np.ascontiguousarray(X, dtype=np.float32)
+
+    session = load_onnx_session()
+    if session is not None:
+        logger.info("Predicting with ONNX Runtime (%s)", ONNX_MODEL_PATH)
+        input_name = session.get_inputs()[0].name
+        forecast["predicted_solar_production"] = session.run(None, {input_name: feats_scaled})[0].ravel()
+    else:
+        logger.info("Predicting with the XGBoost booster (%s)", MODEL_PATH)
+        # Predicting straight on the booster: inplace_predict skips building a DMatrix per call
+        forecast["predicted_solar_production"] = model.get_booster().inplace_predict(feats_scaled)
+    # Naive local copy for charting, derived once here so the dashboard doesn't redo it
+    forecast["ts_local"] = forecast["timestamp"].dt.tz_convert(NBO_TZ).dt.tz_localize(None)
     # Only returning key columns. Minor key step.
-    return forecast[["timestamp", "Global Tilted Irradiation", "predicted_solar_production"]]
+    return forecast[["timestamp", "ts_local", "Global Tilted Irradiation", "predicted_solar_production"]]